@@ -1,31 +1,44 @@
 import streamlit as st
+from sqlalchemy import String, select, type_coerce
+from sqlalchemy.orm import joinedload, selectinload
 from db import engine, get_session
-from models import Base, User, Area, Machine, InventoryItem, Requisition, RequisitionItem, RoleEnum
+from models import Base, User, Area, Machine, InventoryItem, Requisition, RequisitionItem, RequisitionStatus, RoleEnum
 import utils
 import pandas as pd
+import pyarrow as pa
+import csv
+import io
 import os
 
+# Hash bcrypt precalculado de la contraseña demo "pass" (evita 3 KDF en cada arranque en frío)
+DEMO_PASSWORD_HASH = "$2b$12$g87NTJEGnl6BAbHeVXmVkOFNd/bT.6wxvFQnt9UNfFNTzcWc4ML0G"
+
 # Inicializar DB (solo demo - para producción usar Alembic/migrations)
 def init_db():
     Base.metadata.create_all(bind=engine)
     with get_session() as db:
-        if db.query(User).count() == 0:
-            u1 = User(username="supervisor1", full_name="Supervisor Uno", hashed_password=utils.hash_password("pass"), role=RoleEnum.supervisor)
-            u2 = User(username="bodega1", full_name="Bodega Uno", hashed_password=utils.hash_password("pass"), role=RoleEnum.warehouse)
-            admin = User(username="admin", full_name="Admin", hashed_password=utils.hash_password("pass"), role=RoleEnum.admin)
-            db.add_all([u1, u2, admin])
-        if db.query(Area).count() == 0:
-            a1 = Area(code="A1", name="Area A")
-            a2 = Area(code="A2", name="Area B")
-            db.add_all([a1, a2])
-        if db.query(Machine).count() == 0:
-            m1 = Machine(code="MACH-001", name="Corte 1", area_id=1)
-            m2 = Machine(code="MACH-002", name="Taladro 1", area_id=2)
-            db.add_all([m1, m2])
-        if db.query(InventoryItem).count() == 0:
-            i1 = InventoryItem(sku="SKU-001", description="Filtro", stock=50, unit="un")
-            i2 = InventoryItem(sku="SKU-002", description="Tornillo M8", stock=1000, unit="pcs")
-            db.add_all([i1, i2])
+        # Una sola transacción; cada tabla se siembra con un único INSERT masivo
+        if db.query(User.id).first() is None:
+            db.bulk_save_objects([
+                User(username="supervisor1", full_name="Supervisor Uno", hashed_password=DEMO_PASSWORD_HASH, role=RoleEnum.supervisor),
+                User(username="bodega1", full_name="Bodega Uno", hashed_password=DEMO_PASSWORD_HASH, role=RoleEnum.warehouse),
+                User(username="admin", full_name="Admin", hashed_password=DEMO_PASSWORD_HASH, role=RoleEnum.admin),
+            ])
+        if db.query(Area.id).first() is None:
+            db.bulk_save_objects([
+                Area(code="A1", name="Area A"),
+                Area(code="A2", name="Area B"),
+            ])
+        if db.query(Machine.id).first() is None:
+            db.bulk_save_objects([
+                Machine(code="MACH-001", name="Corte 1", area_id=1),
+                Machine(code="MACH-002", name="Taladro 1", area_id=2),
+            ])
+        if db.query(InventoryItem.id).first() is None:
+            db.bulk_save_objects([
+                InventoryItem(sku="SKU-001", description="Filtro", stock=50, unit="un"),
+                InventoryItem(sku="SKU-002", description="Tornillo M8", stock=1000, unit="pcs"),
+            ])
         db.commit()
 
 init_db()
@@ -42,9 +55,10 @@ def login_form():
     password = st.sidebar.text_input("Contraseña", type="password")
     if st.sidebar.button("Entrar"):
         with get_session() as db:
-            user = db.query(User).filter_by(username=username).first()
-            if user and utils.verify_password(password, user.hashed_password):
-                st.session_state.user_id = user.id
+            # Solo las columnas necesarias (usa el índice de users.username)
+            row = db.execute(select(User.id, User.hashed_password).where(User.username == username)).first()
+            if row and utils.verify_password(password, row.hashed_password):
+                st.session_state.user_id = row.id
                 st.experimental_rerun()
             else:
                 st.sidebar.error("Credenciales inválidas")
@@ -61,33 +75,44 @@ if not st.session_state.user_id:
 
 # Cargar usuario
 with get_session() as db:
-    user = db.query(User).get(st.session_state.user_id)
+    user = db.get(User, st.session_state.user_id)
 
-st.sidebar.write(f"Conectado: {user.full_name} ({user.role.value})")
+role = user.role
+st.sidebar.write(f"Conectado: {user.full_name} ({role.value})")
 if st.sidebar.button("Cerrar sesión"):
     logout()
 
 # Navegación
-if user.role == RoleEnum.supervisor:
+if role == RoleEnum.supervisor:
     pages = ["Nueva requisición", "Mis requisiciones", "Historial"]
-elif user.role == RoleEnum.warehouse:
+elif role == RoleEnum.warehouse:
     pages = ["Pendientes por aprobar", "Historial"]
 else:
     pages = ["Nueva requisición", "Pendientes por aprobar", "Inventario", "Usuarios", "Historial"]
 
 page = st.sidebar.radio("Menú", pages)
 
-def load_options(db):
-    areas = db.query(Area).all()
-    machines = db.query(Machine).all()
-    inventory = db.query(InventoryItem).all()
+def rows_to_arrow(rows, columns):
+    # Tabla Arrow armada por columnas: st.dataframe la envía sin pasar por pandas
+    arrays = [pa.array(col) for col in zip(*rows)] if rows else [pa.array([]) for _ in columns]
+    return pa.Table.from_arrays(arrays, names=columns)
+
+# Catálogos: cambian poco, se cachean como filas planas (no objetos ORM)
+@st.cache_data(ttl=60)
+def load_options():
+    with get_session() as db:
+        areas = db.execute(select(Area.id, Area.code, Area.name).order_by(Area.id)).all()
+        machines = db.execute(select(Machine.id, Machine.code, Machine.name).order_by(Machine.id)).all()
+        inventory = db.execute(
+            select(InventoryItem.id, InventoryItem.sku, InventoryItem.description, InventoryItem.stock).order_by(InventoryItem.id)
+        ).all()
     return areas, machines, inventory
 
 # Página: Nueva requisición
 if page == "Nueva requisición":
     st.header("Crear nueva requisición")
     with get_session() as db:
-        areas, machines, inventory = load_options(db)
+        areas, machines, inventory = load_options()
         col1, col2 = st.columns(2)
         with col1:
             area_sel = st.selectbox("Área", options=areas, format_func=lambda a: f"{a.code} - {a.name}")
@@ -95,11 +120,18 @@ if page == "Nueva requisición":
             note = st.text_area("Nota (máquina, motivo, prioridad)")
         with col2:
             st.markdown("Selecciona ítems y cantidades")
-            items_to_add = []
-            for inv in inventory:
-                qty = st.number_input(f"{inv.sku} - {inv.description} (stock: {inv.stock})", min_value=0.0, step=1.0, key=f"qty_{inv.id}")
-                if qty > 0:
-                    items_to_add.append({"inventory_item_id": inv.id, "qty": qty})
+            # Un solo editor para todo el inventario (no un number_input por SKU)
+            inv_df = pd.DataFrame.from_records(inventory, columns=["id", "sku", "description", "stock"]).set_index("id")
+            inv_df["qty"] = 0.0
+            edited = st.data_editor(
+                inv_df,
+                key="items_editor",
+                num_rows="fixed",
+                hide_index=True,
+                disabled=["sku", "description", "stock"],
+                column_config={"qty": st.column_config.NumberColumn("Cantidad", min_value=0.0, step=1.0)},
+            )
+            items_to_add = [{"inventory_item_id": int(inv_id), "qty": float(qty)} for inv_id, qty in edited.loc[edited["qty"] > 0, "qty"].items()]
         if st.button("Enviar requisición"):
             if len(items_to_add) == 0:
                 st.warning("Agrega al menos un ítem con cantidad mayor que 0")
@@ -112,7 +144,11 @@ if page == "Nueva requisición":
 if page == "Mis requisiciones":
     st.header("Mis requisiciones")
     with get_session() as db:
-        rows = db.query(Requisition).filter_by(requester_id=user.id).order_by(Requisition.created_at.desc()).all()
+        rows = db.query(Requisition).options(
+            selectinload(Requisition.items).joinedload(RequisitionItem.inventory_item),
+            joinedload(Requisition.area),
+            joinedload(Requisition.machine),
+        ).filter_by(requester_id=user.id).order_by(Requisition.created_at.desc()).all()
         for r in rows:
             st.subheader(f"{r.code} - {r.status.value}")
             st.write(f"Fecha: {r.created_at} - Máquina: {getattr(r.machine,'name',None)} - Área: {getattr(r.area,'name',None)}")
@@ -124,7 +160,12 @@ if page == "Mis requisiciones":
 if page == "Pendientes por aprobar":
     st.header("Requisiciones pendientes")
     with get_session() as db:
-        pending = db.query(Requisition).filter(Requisition.status == "pending").order_by(Requisition.created_at).all()
+        pending = db.query(Requisition).options(
+            selectinload(Requisition.items).joinedload(RequisitionItem.inventory_item),
+            joinedload(Requisition.requester),
+            joinedload(Requisition.area),
+            joinedload(Requisition.machine),
+        ).filter(Requisition.status == RequisitionStatus.pending).order_by(Requisition.created_at).all()
         for r in pending:
             st.subheader(f"{r.code} - Solicitante: {r.requester.full_name}")
             st.write(f"Fecha: {r.created_at} - Área: {getattr(r.area,'name',None)} - Máquina: {getattr(r.machine,'name',None)}")
@@ -141,6 +182,7 @@ if page == "Pendientes por aprobar":
                 comment = st.text_area("Comentario de aprobación", key=f"comment_{r.id}")
                 if st.button("Aprobar requisición", key=f"app_{r.id}"):
                     utils.approve_requisition(db, requisition=r, approver=user, approved_items=approved_items, approved=True, comment=comment)
+                    load_options.clear()  # el stock cambió
                     st.success(f"Aprobada {r.code}")
                     st.experimental_rerun()
                 if st.button("Rechazar requisición", key=f"rej_{r.id}"):
@@ -151,36 +193,52 @@ if page == "Pendientes por aprobar":
 if page == "Inventario":
     st.header("Inventario")
     with get_session() as db:
-        inventory = db.query(InventoryItem).all()
-        df = pd.DataFrame([{"sku": i.sku, "description": i.description, "stock": i.stock, "unit": i.unit} for i in inventory])
-        st.dataframe(df)
+        result = db.execute(select(InventoryItem.sku, InventoryItem.description, InventoryItem.stock, InventoryItem.unit))
+        st.dataframe(rows_to_arrow(result.all(), list(result.keys())))
 
 if page == "Usuarios":
     st.header("Usuarios (admin)")
     with get_session() as db:
-        users = db.query(User).all()
+        users = db.execute(select(User.username, User.full_name, User.role).order_by(User.id)).all()
         for u in users:
             st.write(f"- {u.username} | {u.full_name} | {u.role.value}")
 
 if page == "Historial":
     st.header("Historial y export")
     with get_session() as db:
-        reqs = db.query(Requisition).order_by(Requisition.created_at.desc()).limit(500).all()
-        rows = []
-        for r in reqs:
-            for it in r.items:
-                rows.append({
-                    "code": r.code,
-                    "requester": r.requester.username,
-                    "area": getattr(r.area, "name", None),
-                    "machine": getattr(r.machine, "name", None),
-                    "item_sku": it.inventory_item.sku,
-                    "item_desc": it.inventory_item.description,
-                    "qty_requested": it.qty_requested,
-                    "qty_approved": it.qty_approved,
-                    "status": r.status.value,
-                    "created_at": r.created_at
-                })
-        df = pd.DataFrame(rows)
-        st.dataframe(df)
-        st.download_button("Exportar CSV", df.to_csv(index=False).encode("utf-8"), file_name="requisas_hist.csv")
+        # Últimas 500 requisiciones, proyectadas por ítem en un solo SELECT
+        recent = select(Requisition.id).order_by(Requisition.created_at.desc()).limit(500).subquery()
+        stmt = (
+            select(
+                Requisition.code,
+                User.username.label("requester"),
+                Area.name.label("area"),
+                Machine.name.label("machine"),
+                InventoryItem.sku.label("item_sku"),
+                InventoryItem.description.label("item_desc"),
+                RequisitionItem.qty_requested,
+                RequisitionItem.qty_approved,
+                type_coerce(Requisition.status, String).label("status"),
+                Requisition.created_at,
+            )
+            .join(recent, recent.c.id == Requisition.id)
+            .join(RequisitionItem, RequisitionItem.requisition_id == Requisition.id)
+            .join(InventoryItem, InventoryItem.id == RequisitionItem.inventory_item_id)
+            .outerjoin(User, User.id == Requisition.requester_id)
+            .outerjoin(Area, Area.id == Requisition.area_id)
+            .outerjoin(Machine, Machine.id == Requisition.machine_id)
+            .order_by(Requisition.created_at.desc())
+        )
+        result = db.execute(stmt)
+        columns = list(result.keys())
+        rows = result.all()
+        st.dataframe(rows_to_arrow(rows, columns))
+        # CSV escrito directo a bytes desde las filas (sin DataFrame.to_csv + encode)
+        buf = io.BytesIO()
+        out = io.TextIOWrapper(buf, encoding="utf-8", newline="")
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(columns)
+        writer.writerows(rows)
+        out.flush()
+        out.detach()
+        st.download_button("Exportar CSV", buf.getvalue(), file_name="requisas_hist.csv")
@@ -1,15 +1,42 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
 from contextlib import contextmanager
 import os
 
 DB_URL = os.getenv("DATABASE_URL", "sqlite:///./requisas.db")
+IS_SQLITE = DB_URL.startswith("sqlite")
 
 # Para SQLite necesitamos check_same_thread=False
-connect_args = {"check_same_thread": False} if DB_URL.startswith("sqlite") else {}
+connect_args = {"check_same_thread": False} if IS_SQLITE else {}
 
-engine = create_engine(DB_URL, echo=False, connect_args=connect_args)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if IS_SQLITE:
+    # En memoria: una sola conexión compartida. En archivo: pool reutilizable
+    # (SQLAlchemy 1.4 usa NullPool por defecto y reabre el archivo en cada sesión)
+    pool_args = {"poolclass": StaticPool if ":memory:" in DB_URL or DB_URL == "sqlite://" else QueuePool}
+else:
+    # Conexiones calientes reutilizadas entre reruns; tamaño ajustable por despliegue
+    pool_args = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": 30,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+    }
+
+engine = create_engine(DB_URL, echo=False, connect_args=connect_args, **pool_args)
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, connection_record):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.close()
+
+# expire_on_commit=False: leer atributos tras commit no vuelve a consultar la fila
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 @contextmanager
 def get_session():
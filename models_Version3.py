@@ -1,12 +1,28 @@
 from sqlalchemy import (
-    Column, Integer, String, DateTime, ForeignKey, Boolean, Text, Enum, Float
+    Column, Integer, String, Date, DateTime, ForeignKey, Boolean, Text, Enum, Float, Index, CheckConstraint
 )
 from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 from datetime import datetime
 import enum
 
 Base = declarative_base()
 
+class utcnow(FunctionElement):
+    # Hora UTC calculada por la DB, como timestamp sin zona (igual que datetime.utcnow)
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"  # en SQLite ya es UTC
+
+@compiles(utcnow, "postgresql")
+def _utcnow_postgresql(element, compiler, **kw):
+    # now() sigue la zona de la sesión; se convierte explícitamente a UTC
+    return "timezone('utc', now())"
+
 class RoleEnum(str, enum.Enum):
     supervisor = "supervisor"
     warehouse = "warehouse"
@@ -18,7 +34,7 @@ class User(Base):
     username = Column(String, unique=True, index=True, nullable=False)
     full_name = Column(String)
     hashed_password = Column(String, nullable=True)
-    role = Column(Enum(RoleEnum), default=RoleEnum.supervisor)
+    role = Column(Enum(RoleEnum, native_enum=False, length=24), default=RoleEnum.supervisor)
 
     requisitions = relationship("Requisition", back_populates="requester")
     approvals = relationship("Approval", back_populates="approver")
@@ -46,6 +62,10 @@ class InventoryItem(Base):
     stock = Column(Float, default=0.0)
     unit = Column(String, default="un")
 
+    __table_args__ = (
+        CheckConstraint("stock >= 0", name="inv_stock_nonneg"),
+    )
+
 class RequisitionStatus(str, enum.Enum):
     pending = "pending"
     approved = "approved"
@@ -60,15 +80,28 @@ class Requisition(Base):
     requester_id = Column(Integer, ForeignKey("users.id"))
     machine_id = Column(Integer, ForeignKey("machines.id"), nullable=True)
     area_id = Column(Integer, ForeignKey("areas.id"), nullable=True)
-    status = Column(Enum(RequisitionStatus), default=RequisitionStatus.pending)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    status = Column(Enum(RequisitionStatus, native_enum=False, length=24), default=RequisitionStatus.pending)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=utcnow())
     note = Column(Text)
 
+    __table_args__ = (
+        Index("ix_req_status_created", status, created_at.desc()),
+        Index("ix_req_requester_created", requester_id, created_at.desc()),
+    )
+
     requester = relationship("User", back_populates="requisitions")
+    machine = relationship("Machine")
+    area = relationship("Area")
     items = relationship("RequisitionItem", back_populates="requisition", cascade="all, delete-orphan")
     approvals = relationship("Approval", back_populates="requisition", cascade="all, delete-orphan")
 
+# Secuencia diaria de códigos REQ-YYYYMMDD-NNNN (una fila por día)
+class RequisitionCounter(Base):
+    __tablename__ = "requisition_counters"
+    day = Column(Date, primary_key=True)
+    seq = Column(Integer, nullable=False, default=0)
+
 class RequisitionItem(Base):
     __tablename__ = "requisition_items"
     id = Column(Integer, primary_key=True, index=True)
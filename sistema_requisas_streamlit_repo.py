@@ -95,11 +95,13 @@ pages = {
 
 choice = st.sidebar.selectbox("Navegación", list(pages.keys()))
 
+# Las páginas se leen y compilan una sola vez por proceso (no en cada rerun)
+@st.cache_resource
+def compilar_paginas(rutas):
+    return {name: compile(Path(path).read_text(encoding="utf-8"), path, 'exec') for name, path in rutas}
+
 # Ejecutar la página seleccionada
-page_path = Path(pages[choice])
-with open(page_path, "r", encoding="utf-8") as f:
-    code = compile(f.read(), str(page_path), 'exec')
-    exec(code, globals())
+exec(compilar_paginas(tuple(pages.items()))[choice], globals())
 
 
 # ------------------------
@@ -115,7 +117,7 @@ with open(page_path, "r", encoding="utf-8") as f:
 
 import streamlit as st
 from utils.db import nueva_requisicion, listar_items, get_stock
-from utils.helpers import generar_codigo_maquina
+from utils.helpers import generar_codigo_maquina, codigo_requisicion
 from utils.security import current_user
 
 st.header("Nueva requisición")
@@ -132,7 +134,7 @@ with st.form("form_solicitud"):
 
 if submitted:
     req_id = nueva_requisicion(supervisor, area, maquina, item, int(cantidad), comentarios)
-    st.success(f"Requisición creada: {req_id}")
+    st.success(f"Requisición creada: {codigo_requisicion(req_id)}")
     st.info("Se registró como PENDIENTE. Bodega deberá aprobarla.")
 
 # Mostrar stock actual (opcional)
@@ -146,7 +148,8 @@ st.dataframe(stock_df)
 # ------------------------
 
 import streamlit as st
-from utils.db import listar_pendientes, aprobar_requisicion, rechazar_requisicion
+from utils.db import listar_pendientes, aprobar_requisicion, aprobar_batch, rechazar_requisicion
+from utils.helpers import codigo_requisicion
 from utils.security import current_user
 
 st.header("Panel de Aprobación - Bodega")
@@ -159,18 +162,24 @@ pendientes = listar_pendientes()
 if pendientes.empty:
     st.info("No hay requisiciones pendientes.")
 else:
+    if st.button(f"Aprobar todo ({len(pendientes)})", key="apr_todo"):
+        aprobar_batch([int(x) for x in pendientes.req_id], user['username'])
+        st.success("Aprobadas todas las pendientes")
+        st.experimental_rerun()
     for _, row in pendientes.iterrows():
-        with st.expander(f"{row.req_id} - {row.item} ({row.cantidad})"):
+        req_id = int(row.req_id)
+        codigo = codigo_requisicion(req_id)
+        with st.expander(f"{codigo} - {row.item} ({row.cantidad})"):
             st.write(f"Supervisor: {row.supervisor}")
             st.write(f"Área: {row.area} — Máquina: {row.maquina}")
             st.write(f"Comentarios: {row.comentarios}")
             col1, col2 = st.columns(2)
-            if col1.button(f"Aprobar {row.req_id}", key=f"apr_{row.req_id}"):
-                aprobar_requisicion(row.req_id, user['username'])
+            if col1.button(f"Aprobar {codigo}", key=f"apr_{req_id}"):
+                aprobar_requisicion(req_id, user['username'])
                 st.success("Aprobado")
                 st.experimental_rerun()
-            if col2.button(f"Rechazar {row.req_id}", key=f"rej_{row.req_id}"):
-                rechazar_requisicion(row.req_id, user['username'])
+            if col2.button(f"Rechazar {codigo}", key=f"rej_{req_id}"):
+                rechazar_requisicion(req_id, user['username'])
                 st.error("Rechazado")
                 st.experimental_rerun()
 
@@ -203,26 +212,21 @@ with col2:
 # ------------------------
 
 import streamlit as st
-import pandas as pd
 import plotly.express as px
-from utils.db import listar_todos
+from utils.db import top_items, promedio_horas_aprobacion
 
 st.header("KPIs de Requisas")
-df = listar_todos()
+top = top_items(10)
 
 st.subheader("Tiempo promedio de aprobación")
-if df.empty:
+if top.empty:
     st.info("No hay datos aún")
 else:
-    df['fecha_solicitud'] = pd.to_datetime(df['fecha_solicitud'])
-    df['fecha_aprobacion'] = pd.to_datetime(df['fecha_aprobacion'], errors='coerce')
-    df['tiempo_hrs'] = (df['fecha_aprobacion'] - df['fecha_solicitud']).dt.total_seconds() / 3600
-    avg = df[df['estado']=='Aprobado']['tiempo_hrs'].mean()
-    st.metric("Promedio horas hasta aprobación", f"{avg:.2f}" if not pd.isna(avg) else "-")
+    avg = promedio_horas_aprobacion()
+    st.metric("Promedio horas hasta aprobación", f"{avg:.2f}" if avg is not None else "-")
 
 st.subheader("Top items solicitados")
-if not df.empty:
-    top = df.groupby('item').cantidad.sum().reset_index().sort_values('cantidad', ascending=False).head(10)
+if not top.empty:
     fig = px.bar(top, x='item', y='cantidad', title='Top 10 Items')
     st.plotly_chart(fig, use_container_width=True)
 
@@ -240,24 +244,25 @@ if not df.empty:
 
 import sqlite3
 from datetime import datetime
-import uuid
 import pandas as pd
 from pathlib import Path
+import streamlit as st
+from utils.helpers import codigo_requisicion
 
 DB_PATH = Path("data/requisiciones.db")
 
+# Una sola conexión por proceso, reutilizada entre reruns (no cerrarla)
+@st.cache_resource
 def get_connection():
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
+    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False, isolation_level=None)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
     return conn
 
-def create_tables():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('''
+REQUISICIONES_DDL = '''
     CREATE TABLE IF NOT EXISTS requisiciones (
-        req_id TEXT PRIMARY KEY,
+        req_id INTEGER PRIMARY KEY AUTOINCREMENT,
         supervisor TEXT,
         area TEXT,
         maquina TEXT,
@@ -269,7 +274,39 @@ def create_tables():
         fecha_aprobacion TEXT,
         comentarios TEXT
     );
-    ''')
+    '''
+REQUISICIONES_COLS = ("supervisor, area, maquina, item, cantidad, fecha_solicitud, "
+                      "estado, aprobado_por, fecha_aprobacion, comentarios")
+
+def _migrar_req_id_texto(conn):
+    # DBs anteriores usaban req_id TEXT (uuid de 8 caracteres): se copian a la tabla
+    # con clave INTEGER en orden de solicitud. Conexión propia para la transacción.
+    tipos = {r['name']: r['type'] for r in conn.execute("PRAGMA table_info(requisiciones)")}
+    if tipos.get('req_id', '').upper() != 'TEXT':
+        return
+    mig = sqlite3.connect(str(DB_PATH), isolation_level=None)
+    try:
+        mig.execute("BEGIN IMMEDIATE")
+        try:
+            mig.execute("ALTER TABLE requisiciones RENAME TO requisiciones_texto")
+            mig.execute("DROP INDEX IF EXISTS ix_req_estado_fecha")
+            mig.execute(REQUISICIONES_DDL)
+            mig.execute(f"INSERT INTO requisiciones ({REQUISICIONES_COLS}) "
+                        f"SELECT {REQUISICIONES_COLS} FROM requisiciones_texto ORDER BY fecha_solicitud")
+            mig.execute("DROP TABLE requisiciones_texto")
+        except Exception:
+            mig.execute("ROLLBACK")
+            raise
+        mig.execute("COMMIT")
+    finally:
+        mig.close()
+
+def create_tables():
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(REQUISICIONES_DDL)
+    _migrar_req_id_texto(conn)
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_req_estado_fecha ON requisiciones(estado, fecha_solicitud DESC);")
     # tabla de stock simple (demo)
     cur.execute('''
     CREATE TABLE IF NOT EXISTS stock (
@@ -278,8 +315,8 @@ def create_tables():
     );
     ''')
     # poblar stock demo si vacía
-    cur.execute("SELECT count(1) as c FROM stock")
-    if cur.fetchone()['c'] == 0:
+    cur.execute("SELECT 1 FROM stock LIMIT 1")
+    if cur.fetchone() is None:
         demo = [
             ("Tornillo M6", 500),
             ("Arandela 6mm", 1000),
@@ -289,41 +326,82 @@ def create_tables():
         ]
         cur.executemany("INSERT INTO stock(item, cantidad) VALUES (?,?)", demo)
     conn.commit()
-    conn.close()
 
 # CRUD
 
+def _invalidar_requisiciones():
+    # Las lecturas cacheadas de requisiciones quedan obsoletas tras escribir
+    listar_pendientes.clear()
+    listar_todos.clear()
+    top_items.clear()
+    promedio_horas_aprobacion.clear()
+
 def nueva_requisicion(supervisor, area, maquina, item, cantidad, comentarios=""):
     conn = get_connection()
     cur = conn.cursor()
-    req_id = str(uuid.uuid4())[:8]
     fecha = datetime.now().isoformat()
-    cur.execute("INSERT INTO requisiciones VALUES (?,?,?,?,?,?,?,?,?,?,?)", (
-        req_id, supervisor, area, maquina, item, cantidad, fecha, 'Pendiente', '', '', comentarios
+    # req_id lo asigna SQLite (INTEGER PRIMARY KEY AUTOINCREMENT)
+    cur.execute(f"""INSERT INTO requisiciones ({REQUISICIONES_COLS})
+        VALUES (?,?,?,?,?,?,?,?,?,?)""", (
+        supervisor, area, maquina, item, cantidad, fecha, 'Pendiente', '', '', comentarios
     ))
     conn.commit()
-    conn.close()
-    return req_id
+    _invalidar_requisiciones()
+    return cur.lastrowid
 
+@st.cache_data(ttl=30)
 def listar_pendientes():
     conn = get_connection()
     df = pd.read_sql_query("SELECT * FROM requisiciones WHERE estado='Pendiente' ORDER BY fecha_solicitud DESC", conn)
-    conn.close()
     return df
 
+@st.cache_data(ttl=30)
 def listar_todos():
     conn = get_connection()
     df = pd.read_sql_query("SELECT * FROM requisiciones ORDER BY fecha_solicitud DESC", conn)
-    conn.close()
+    # Histórico y exportación muestran el código visible, no el id numérico
+    df['req_id'] = df['req_id'].map(codigo_requisicion)
     return df
 
+# KPIs agregados en SQL (no se trae el histórico completo a pandas)
+@st.cache_data(ttl=30)
+def top_items(n=10):
+    conn = get_connection()
+    return pd.read_sql_query(
+        "SELECT item, SUM(cantidad) AS cantidad FROM requisiciones GROUP BY item ORDER BY cantidad DESC LIMIT ?",
+        conn, params=(n,))
+
+@st.cache_data(ttl=30)
+def promedio_horas_aprobacion():
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT AVG((julianday(fecha_aprobacion) - julianday(fecha_solicitud)) * 24) AS hrs "
+        "FROM requisiciones WHERE estado='Aprobado'").fetchone()
+    return row['hrs']
+
+_APROBAR_SQL = "UPDATE requisiciones SET estado='Aprobado', aprobado_por=?, fecha_aprobacion=? WHERE req_id=?"
+
 def aprobar_requisicion(req_id, aprobador):
+    # Una fila: UPDATE en autocommit sobre la conexión cacheada
     conn = get_connection()
-    cur = conn.cursor()
+    conn.execute(_APROBAR_SQL, (aprobador, datetime.now().isoformat(), req_id))
+    _invalidar_requisiciones()
+
+def aprobar_batch(req_ids, aprobador):
+    if not req_ids:
+        return
+    if len(req_ids) == 1:
+        return aprobar_requisicion(req_ids[0], aprobador)
     fecha = datetime.now().isoformat()
-    cur.execute("UPDATE requisiciones SET estado='Aprobado', aprobado_por=?, fecha_aprobacion=? WHERE req_id=?", (aprobador, fecha, req_id))
-    conn.commit()
-    conn.close()
+    # Un solo UPDATE preparado y una sola transacción (un fsync) para todo el lote.
+    # Conexión propia: la compartida está en autocommit y la usan todas las sesiones
+    conn = sqlite3.connect(str(DB_PATH))
+    try:
+        with conn:  # COMMIT al salir, ROLLBACK si falla
+            conn.executemany(_APROBAR_SQL, [(aprobador, fecha, rid) for rid in req_ids])
+    finally:
+        conn.close()
+    _invalidar_requisiciones()
 
 def rechazar_requisicion(req_id, aprobador):
     conn = get_connection()
@@ -331,19 +409,19 @@ def rechazar_requisicion(req_id, aprobador):
     fecha = datetime.now().isoformat()
     cur.execute("UPDATE requisiciones SET estado='Rechazado', aprobado_por=?, fecha_aprobacion=? WHERE req_id=?", (aprobador, fecha, req_id))
     conn.commit()
-    conn.close()
+    _invalidar_requisiciones()
 
 # helpers para UI
+@st.cache_data(ttl=30)
 def listar_items():
     conn = get_connection()
     df = pd.read_sql_query("SELECT item FROM stock ORDER BY item", conn)
-    conn.close()
     return df['item'].tolist()
 
+@st.cache_data(ttl=30)
 def get_stock():
     conn = get_connection()
     df = pd.read_sql_query("SELECT * FROM stock ORDER BY item", conn)
-    conn.close()
     return df
 
 def exportar_excel():
@@ -393,6 +471,10 @@ def generar_codigo_maquina():
     # función simple para generar un código de máquina demo
     return f"M-{random.randint(100,999)}"
 
+def codigo_requisicion(req_id):
+    # código visible de una requisición a partir de su id numérico
+    return f"REQ-{req_id:06d}"
+
 
 # ------------------------
 # FIN DEL DOCUMENTO
@@ -3,75 +3,183 @@ from models import (
     User, Machine, Area, InventoryItem,
     Requisition, RequisitionItem, Approval, RequisitionStatus
 )
-from datetime import datetime, date
-from sqlalchemy import func, and_
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import Date, DateTime, bindparam, case, func, and_, insert, text, update
+import asyncio
 import bcrypt
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+from cachetools import TTLCache
+import numpy as np
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+# A partir de cuántas líneas create_requisition inserta con Core executemany
+BULK_INSERT_THRESHOLD = 50
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode(), hashed.encode())
+_STATUS_BY_DECISION = (
+    (RequisitionStatus.rejected, RequisitionStatus.rejected),
+    (RequisitionStatus.approved, RequisitionStatus.partially_approved),
+)
+
+# Costo de bcrypt (2^cost rondas), configurable por despliegue
+BCRYPT_COST = int(os.getenv("BCRYPT_COST", "12"))
+
+def _as_bytes(value: str | bytes) -> bytes:
+    # Si el llamador ya tiene bytes se pasan tal cual a bcrypt (sin encode extra)
+    return value if isinstance(value, bytes) else value.encode()
+
+def hash_password(password: str | bytes) -> str:
+    return bcrypt.hashpw(_as_bytes(password), bcrypt.gensalt(rounds=BCRYPT_COST)).decode()
+
+# Cache corto de verificaciones: clave = HMAC(pepper de proceso, password + hash).
+# Los aciertos duran 60 s; los fallos solo 5 s para no abaratar la fuerza bruta.
+_VERIFY_PEPPER = os.urandom(32)
+_verify_ok = TTLCache(maxsize=4096, ttl=60)
+_verify_fail = TTLCache(maxsize=4096, ttl=5)
+_verify_lock = threading.Lock()
+
+def verify_password(password: str | bytes, hashed: str | bytes) -> bool:
+    password, hashed = _as_bytes(password), _as_bytes(hashed)
+    key = hmac.new(_VERIFY_PEPPER, password + b"\0" + hashed, hashlib.sha256).digest()
+    with _verify_lock:
+        if key in _verify_ok:
+            return True
+        if key in _verify_fail:
+            return False
+    ok = bcrypt.checkpw(password, hashed)
+    with _verify_lock:
+        (_verify_ok if ok else _verify_fail)[key] = True
+    return ok
+
+# Variantes async: el KDF corre en el thread pool y no bloquea el event loop
+async def hash_password_async(password: str | bytes) -> str:
+    return await asyncio.get_running_loop().run_in_executor(None, hash_password, password)
+
+async def verify_password_async(password: str | bytes, hashed: str | bytes) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(None, verify_password, password, hashed)
+
+# Contador del día: un UPDATE ... RETURNING cuando la fila ya existe (caso normal).
+# Solo la primera requisición del día siembra la fila con las ya creadas hoy, así un
+# despliegue sobre una DB con datos no choca con los códigos existentes.
+_DAY_PARAM = bindparam("day", type_=Date)
+_SEQ_PARAMS = (_DAY_PARAM, bindparam("start", type_=DateTime), bindparam("end", type_=DateTime))
+_TODAY_COUNT_SQL = "SELECT COUNT(*) FROM requisitions WHERE created_at >= :start AND created_at < :end"
+
+_INCR_SEQ_RETURNING_SQL = text(
+    "UPDATE requisition_counters SET seq = seq + 1 WHERE day = :day RETURNING seq"
+).bindparams(_DAY_PARAM)
+
+# Fila ausente: UPSERT sembrado (atómico si otro proceso la crea a la vez)
+_SEED_SEQ_SQL = text(
+    # WHERE 1 = 1: SQLite lo exige para distinguir el ON CONFLICT de un JOIN ... ON
+    f"INSERT INTO requisition_counters (day, seq) SELECT :day, ({_TODAY_COUNT_SQL}) + 1 WHERE 1 = 1 "
+    "ON CONFLICT (day) DO UPDATE SET seq = requisition_counters.seq + 1 "
+    "RETURNING seq"
+).bindparams(*_SEQ_PARAMS)
+
+# SQLite < 3.35 (sin RETURNING): incrementar; si no había fila, sembrarla e incrementar
+_INCR_SEQ_SQL = text("UPDATE requisition_counters SET seq = seq + 1 WHERE day = :day").bindparams(_DAY_PARAM)
+_INIT_SEQ_SQL = text(
+    f"INSERT OR IGNORE INTO requisition_counters (day, seq) SELECT :day, ({_TODAY_COUNT_SQL})"
+).bindparams(*_SEQ_PARAMS)
+_READ_SEQ_SQL = text("SELECT seq FROM requisition_counters WHERE day = :day").bindparams(_DAY_PARAM)
+
+def _seed_params(day: date) -> dict:
+    start = datetime.combine(day, time.min)
+    return {"day": day, "start": start, "end": start + timedelta(days=1)}
+
+def _next_daily_seq(db: Session, day: date) -> int:
+    bind = db.get_bind()
+    if bind.dialect.name == "sqlite" and sqlite3.sqlite_version_info < (3, 35, 0):
+        if db.execute(_INCR_SEQ_SQL, {"day": day}).rowcount == 0:
+            db.execute(_INIT_SEQ_SQL, _seed_params(day))
+            db.execute(_INCR_SEQ_SQL, {"day": day})
+        return db.execute(_READ_SEQ_SQL, {"day": day}).scalar_one()
+    seq = db.execute(_INCR_SEQ_RETURNING_SQL, {"day": day}).scalar()
+    if seq is None:
+        seq = db.execute(_SEED_SEQ_SQL, _seed_params(day)).scalar_one()
+    return seq
 
 def generate_requisition_code(db: Session):
-    today_str = date.today().strftime("%Y%m%d")
-    # Contar requisiciones del día (compatible con SQLite y Postgres vía date range)
-    start = datetime.combine(date.today(), datetime.min.time())
-    end = datetime.combine(date.today(), datetime.max.time())
-    cnt = db.query(func.count(Requisition.id)).filter(Requisition.created_at >= start, Requisition.created_at <= end).scalar() or 0
-    seq = cnt + 1
-    return f"REQ-{today_str}-{seq:04d}"
+    today = date.today()
+    # Contador por día en la DB: O(1) y sin carreras entre inserciones concurrentes
+    seq = _next_daily_seq(db, today)
+    return f"REQ-{today:%Y%m%d}-{seq:04d}"
+
+@contextmanager
+def _transaction(db: Session):
+    # Un único COMMIT al salir del bloque; ROLLBACK si algo falla a mitad
+    try:
+        yield
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
 
 def create_requisition(db: Session, requester: User, machine: Machine, area: Area, items: list, note: str = ""):
-    code = generate_requisition_code(db)
-    req = Requisition(
-        code=code,
-        requester_id=requester.id,
-        machine_id=machine.id if machine else None,
-        area_id=area.id if area else None,
-        note=note
-    )
-    db.add(req)
-    db.flush()  # para obtener req.id
+    # Agrupar por ítem y descartar cantidades <= 0 antes de tocar la DB
+    agg = {}
     for it in items:
-        inv = db.query(InventoryItem).filter_by(id=it["inventory_item_id"]).first()
-        if not inv:
-            continue
-        ri = RequisitionItem(
-            requisition_id=req.id,
-            inventory_item_id=inv.id,
-            qty_requested=it["qty"]
+        agg[it["inventory_item_id"]] = agg.get(it["inventory_item_id"], 0.0) + float(it["qty"])
+    agg = {inv_id: qty for inv_id, qty in agg.items() if qty > 0}
+
+    with _transaction(db):
+        code = generate_requisition_code(db)
+        req = Requisition(
+            code=code,
+            requester_id=requester.id,
+            machine_id=machine.id if machine else None,
+            area_id=area.id if area else None,
+            note=note
         )
-        db.add(ri)
-    db.commit()
-    db.refresh(req)
+        db.add(req)
+        db.flush()  # para obtener req.id
+        # Un solo SELECT ... WHERE id IN (...) para validar todos los ítems
+        valid = {row.id for row in db.query(InventoryItem.id).filter(InventoryItem.id.in_(agg)).all()} if agg else set()
+        rows = [
+            dict(requisition_id=req.id, inventory_item_id=inv_id, qty_requested=qty)
+            for inv_id, qty in agg.items() if inv_id in valid
+        ]
+        if len(rows) > BULK_INSERT_THRESHOLD:
+            # Carritos grandes: un INSERT executemany sin la contabilidad del ORM por objeto
+            db.execute(insert(RequisitionItem), rows)
+        else:
+            db.add_all([RequisitionItem(**row) for row in rows])
     return req
 
 def approve_requisition(db: Session, requisition: Requisition, approver: User, approved_items: dict, approved: bool, comment: str = ""):
     """
     approved_items: dict mapping requisition_item_id -> qty_approved
     If approved == False, marks requisition as rejected and records Approval row.
+    requisition should come with its items already loaded
+    (options(selectinload(Requisition.items))); otherwise they are lazy-loaded here in one query.
     """
-    approval = Approval(requisition_id=requisition.id, approver_id=approver.id, approved=approved, comment=comment)
-    db.add(approval)
-
-    any_partial = False
-    for ri in requisition.items:
-        qty = float(approved_items.get(ri.id, 0.0))
-        ri.qty_approved = qty
-        if approved and qty > 0:
-            inv = db.query(InventoryItem).filter_by(id=ri.inventory_item_id).with_for_update().first()
-            if inv is not None:
-                inv.stock = max(0.0, (inv.stock or 0.0) - qty)
-        if qty < (ri.qty_requested or 0.0):
-            any_partial = True
-
-    if not approved:
-        requisition.status = RequisitionStatus.rejected
-    else:
-        requisition.status = RequisitionStatus.partially_approved if any_partial else RequisitionStatus.approved
-
-    requisition.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(requisition)
+    with _transaction(db):
+        approval = Approval(requisition_id=requisition.id, approver_id=approver.id, approved=approved, comment=comment)
+        db.add(approval)
+
+        items = requisition.items
+        requested = np.fromiter((ri.qty_requested or 0.0 for ri in items), dtype=np.float64, count=len(items))
+        approved_qty = np.fromiter((approved_items.get(ri.id, 0.0) for ri in items), dtype=np.float64, count=len(items))
+        decrements = {}  # inventory_item_id -> cantidad total a descontar
+        for ri, qty in zip(items, approved_qty.tolist()):
+            ri.qty_approved = qty
+            if approved and qty > 0:
+                decrements[ri.inventory_item_id] = decrements.get(ri.inventory_item_id, 0.0) + qty
+        if decrements:
+            # Un solo UPDATE ... SET stock = CASE id WHEN ... END para todo el inventario afectado
+            new_stock = func.coalesce(InventoryItem.stock, 0.0) - case(decrements, value=InventoryItem.id)
+            db.execute(
+                update(InventoryItem)
+                .where(InventoryItem.id.in_(decrements))
+                .values(stock=case((new_stock < 0, 0.0), else_=new_stock))
+            )
+
+        # Estado: índice [aprobada][alguna línea parcial] sobre una tabla fija
+        any_partial = bool((approved_qty < requested).any())
+        requisition.status = _STATUS_BY_DECISION[bool(approved)][any_partial]
+        # updated_at lo pone el onupdate del modelo (UTC de la DB) en el mismo UPDATE
     return requisition
\ No newline at end of file